@@ -0,0 +1,247 @@
+#!/usr/bin/env python3
+"""
+POMA 2.0 可观测量代码生成
+把符号可观测量 (自旋算符项 × 三角/指数系数) 翻译成 NumPy 函数，
+做公共子表达式消除，并按表达式哈希缓存到磁盘，之后的运行直接加载。
+"""
+
+import os
+import json
+import hashlib
+import importlib.util
+from fractions import Fraction
+from wolframclient.language.expression import WLFunction, WLSymbol
+
+# 缓存目录，根目录可用环境变量 POMA_CACHE_DIR 覆盖
+CACHE_DIR = os.path.join(
+    os.environ.get('POMA_CACHE_DIR', os.path.join(os.path.expanduser('~'), '.cache', 'poma')),
+    'codegen'
+)
+
+# Wolfram 函数名到 NumPy 函数的映射
+NUMPY_FUNCTIONS = {
+    'Sin': 'np.sin',
+    'Cos': 'np.cos',
+    'Tan': 'np.tan',
+    'Sinh': 'np.sinh',
+    'Cosh': 'np.cosh',
+    'Tanh': 'np.tanh',
+    'Exp': 'np.exp',
+    'Log': 'np.log',
+    'Sqrt': 'np.sqrt',
+    'Abs': 'np.abs',
+    'ArcSin': 'np.arcsin',
+    'ArcCos': 'np.arccos',
+    'ArcTan': 'np.arctan',
+}
+
+# 倒数三角函数 (内核会把 1/Cos[x] 化简成 Sec[x])
+RECIPROCAL_FUNCTIONS = {
+    'Sec': 'np.cos',
+    'Csc': 'np.sin',
+    'Cot': 'np.tan',
+    'Sech': 'np.cosh',
+    'Csch': 'np.sinh',
+    'Coth': 'np.tanh',
+}
+
+NUMPY_CONSTANTS = {
+    'Pi': 'np.pi',
+    'E': 'np.e',
+    'I': '1j',
+    'Degree': '(np.pi / 180)',
+}
+
+
+def symbol_name(symbol):
+    """去掉上下文前缀的符号名"""
+    return symbol.name.split('`')[-1]
+
+
+class NumpyCodeGenerator:
+    """把 Wolfram 表达式树翻译成带公共子表达式消除的 NumPy 代码"""
+
+    def __init__(self, variables):
+        # 内核变量名 -> 生成函数中的参数名
+        self.variables = {name: f'x{i}' for i, name in enumerate(variables)}
+        self.lines = []
+        self.cache = {}
+
+    def emit(self, code):
+        """登记一个子表达式，重复出现时复用同一个临时变量"""
+        if code not in self.cache:
+            name = f'_t{len(self.cache)}'
+            self.cache[code] = name
+            self.lines.append(f'    {name} = {code}')
+        return self.cache[code]
+
+    def translate(self, expr):
+        """递归翻译表达式，返回代表它的 Python 表达式"""
+        if isinstance(expr, bool):
+            raise ValueError(f"不支持的表达式: {expr!r}")
+        if isinstance(expr, int):
+            return repr(float(expr))
+        if isinstance(expr, float):
+            return repr(expr)
+        if isinstance(expr, Fraction):
+            return repr(float(expr))
+        if isinstance(expr, complex):
+            return f'complex({expr.real!r}, {expr.imag!r})'
+        if isinstance(expr, WLSymbol):
+            name = symbol_name(expr)
+            if name in self.variables:
+                return self.variables[name]
+            if name in NUMPY_CONSTANTS:
+                return NUMPY_CONSTANTS[name]
+            raise ValueError(f"未知符号: {name}")
+        if isinstance(expr, WLFunction) and isinstance(expr.head, WLSymbol):
+            return self.translate_function(symbol_name(expr.head), expr.args)
+        raise ValueError(f"不支持的表达式: {expr!r}")
+
+    def translate_function(self, head, args):
+        """翻译函数调用"""
+        if head == 'Rational':
+            return repr(args[0] / args[1])
+        if head == 'Complex':
+            return f'complex({self.translate(args[0])}, {self.translate(args[1])})'
+
+        parts = [self.translate(arg) for arg in args]
+        if head == 'Plus':
+            return self.emit(' + '.join(parts))
+        if head == 'Times':
+            return self.emit(' * '.join(parts))
+        if head == 'Power':
+            return self.emit(f'{parts[0]} ** {parts[1]}')
+        if head in NUMPY_FUNCTIONS and len(parts) == 1:
+            return self.emit(f'{NUMPY_FUNCTIONS[head]}({parts[0]})')
+        if head in RECIPROCAL_FUNCTIONS and len(parts) == 1:
+            return self.emit(f'1.0 / {RECIPROCAL_FUNCTIONS[head]}({parts[0]})')
+        raise ValueError(f"不支持的函数: {head}")
+
+    def generate(self, terms, params):
+        """生成完整模块源码
+
+        terms 为 {自旋算符项: 系数表达式}，params 为原始参数名列表。
+        """
+        outputs = {term: self.translate(coef) for term, coef in terms.items()}
+        args = ', '.join(self.variables.values())
+
+        source = [
+            '# 由 poma_codegen 自动生成，请勿手动修改',
+            'import numpy as np',
+            '',
+            f'PARAMS = {list(params)!r}',
+            f'TERMS = {list(terms)!r}',
+            '',
+            '',
+            f'def observable({args}):',
+            f'    """可观测量各项系数，参数依次为 {", ".join(params)}"""',
+            f'    _shape = np.broadcast({args}, 0.0).shape' if args else '    _shape = ()',
+        ]
+        source.extend(self.lines)
+        source.append('    return {')
+        for term, code in outputs.items():
+            source.append(f'        {term!r}: np.broadcast_to({code}, _shape),')
+        source.append('    }')
+        return '\n'.join(source) + '\n'
+
+
+class ObservableCache:
+    """生成模块的磁盘缓存
+
+    模块按表达式哈希命名；另有一个索引把序列键映射到表达式哈希，
+    以便后续运行只做一次轻量的依赖查询即可加载，无需重新符号推导。
+    """
+
+    def __init__(self, directory=CACHE_DIR):
+        self.directory = directory
+        self.index_path = os.path.join(directory, 'index.json')
+
+    def _read_index(self):
+        try:
+            with open(self.index_path, encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _write(self, path, text):
+        """原子写入，避免并发运行读到半个文件"""
+        os.makedirs(self.directory, exist_ok=True)
+        tmp = f'{path}.{os.getpid()}.tmp'
+        with open(tmp, 'w', encoding='utf-8') as f:
+            f.write(text)
+        os.replace(tmp, path)
+
+    def module_path(self, expr_hash):
+        return os.path.join(self.directory, f'obs_{expr_hash}.py')
+
+    def load_module(self, expr_hash):
+        """加载已生成的模块，不存在时返回 None"""
+        path = self.module_path(expr_hash)
+        if not os.path.exists(path):
+            return None
+        spec = importlib.util.spec_from_file_location(f'poma_obs_{expr_hash}', path)
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        return module
+
+    def lookup(self, key):
+        """按序列键查找已缓存的模块"""
+        expr_hash = self._read_index().get(key)
+        if expr_hash is None:
+            return None
+        return self.load_module(expr_hash)
+
+    def store(self, key, expr_hash, source):
+        """保存生成的模块并更新索引"""
+        if not os.path.exists(self.module_path(expr_hash)):
+            self._write(self.module_path(expr_hash), source)
+        index = self._read_index()
+        index[key] = expr_hash
+        self._write(self.index_path, json.dumps(index, indent=2, ensure_ascii=False))
+        return self.load_module(expr_hash)
+
+
+def sequence_key(sequence, params, dependencies):
+    """序列键: 初始态、步骤、扫描参数以及内核依赖摘要
+
+    dependencies 由 sim.dependency_key 给出，包含 Poma2.m 的哈希和序列中
+    非扫描符号 (j、w、tau 等) 的当前取值。
+    """
+    initial_state, steps = sequence
+    payload = json.dumps(
+        [initial_state, [cmd for _, cmd in steps], list(params), dependencies],
+        ensure_ascii=False, default=str
+    )
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+def expression_hash(terms_fullform, params):
+    """表达式哈希，由内核给出的 FullForm 计算"""
+    payload = json.dumps([terms_fullform, list(params)], ensure_ascii=False)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()[:32]
+
+
+def compile_observable(sim, sequence, params, budget=None, cache=None):
+    """得到序列可观测量的 NumPy 函数
+
+    先按序列键查磁盘缓存；未命中时由内核符号求值一次 (sim.symbolic_observable)，
+    生成代码并缓存。符号结果超过 budget 时返回 None；表达式含无法翻译的
+    函数时抛出 ValueError。
+    """
+    cache = cache or ObservableCache()
+    params = list(params)
+    key = sequence_key(sequence, params, sim.dependency_key(sequence, params))
+
+    module = cache.lookup(key)
+    if module is not None:
+        return module.observable
+
+    derived = sim.symbolic_observable(sequence, params, budget=budget)
+    if derived is None:
+        return None
+    variables, terms, fullform = derived
+
+    source = NumpyCodeGenerator(variables).generate(terms, params)
+    module = cache.store(key, expression_hash(fullform, params), source)
+    return module.observable
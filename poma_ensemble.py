@@ -0,0 +1,197 @@
+#!/usr/bin/env python3
+"""
+POMA 2.0 系综平均
+对偏置、J 耦合、B1 等参数的分布 (带权重) 做可观测量的加权平均。
+系综按块分发给多个工作进程 (各自一个内核)，结果以流式加权和逐块归约。
+可观测量能生成 NumPy 函数时 (poma_codegen) 直接在本进程内向量化求值。
+"""
+
+import sys
+import time
+import itertools
+import multiprocessing
+from multiprocessing.util import Finalize
+import numpy as np
+from wolframclient.language import wlexpr
+
+from run_poma_interactive import NMRSimulator, SWEEP_LEAF_BUDGET
+from poma_session import wl_number
+
+# 默认配置
+DEFAULT_WORKERS = 2      # 工作进程数 (每个进程占用一个内核许可)
+DEFAULT_CHUNK = 64       # 每块样本数，一块只做一次内核求值
+
+
+class Distribution:
+    """参数分布: 取值及其权重"""
+
+    def __init__(self, values, weights=None):
+        self.values = np.asarray(values, dtype=float).ravel()
+        if weights is None:
+            weights = np.ones_like(self.values)
+        self.weights = np.asarray(weights, dtype=float).ravel()
+        if self.weights.shape != self.values.shape:
+            raise ValueError("取值与权重长度不一致")
+        if self.weights.sum() <= 0:
+            raise ValueError("权重之和必须为正")
+        self.weights = self.weights / self.weights.sum()
+
+    def __len__(self):
+        return len(self.values)
+
+    @classmethod
+    def gaussian(cls, center, sigma, n=21, width=3.0):
+        """截断在 ±width·sigma 内的离散高斯分布"""
+        values = np.linspace(center - width * sigma, center + width * sigma, n)
+        return cls(values, np.exp(-0.5 * ((values - center) / sigma) ** 2))
+
+    @classmethod
+    def uniform(cls, low, high, n=21):
+        """均匀分布"""
+        return cls(np.linspace(low, high, n))
+
+
+class StreamingAverage:
+    """流式加权和: 每块结果到达时累加，不保留单个样本"""
+
+    def __init__(self):
+        self.sums = {}
+        self.weight = 0.0
+        self.count = 0
+
+    def add(self, sums, weight, count):
+        for term, value in sums.items():
+            self.sums[term] = self.sums.get(term, 0.0) + value
+        self.weight += weight
+        self.count += count
+
+    def result(self):
+        average = {}
+        for term, value in self.sums.items():
+            value = complex(value) / self.weight
+            average[term] = value.real if abs(value.imag) <= 1e-12 * max(1.0, abs(value)) else value
+        return average
+
+
+def print_progress(done, total, elapsed):
+    """默认进度显示"""
+    rate = done / elapsed if elapsed > 0 else 0.0
+    print(f"\r   ⏳ 系综进度: {done}/{total} ({100 * done / total:5.1f}%)  {rate:8.1f} 样本/秒",
+          end='' if done < total else '\n', flush=True)
+
+
+def iter_chunks(distributions, chunk_size):
+    """惰性枚举系综样本 (笛卡尔积)，每块为 (取值矩阵, 权重向量)"""
+    grids = [list(zip(d.values, d.weights)) for d in distributions.values()]
+    samples = itertools.product(*grids)
+    while True:
+        chunk = list(itertools.islice(samples, chunk_size))
+        if not chunk:
+            return
+        values = np.array([[v for v, _ in sample] for sample in chunk])
+        weights = np.array([np.prod([w for _, w in sample]) for sample in chunk])
+        yield values, weights
+
+
+# ---- 工作进程 ----
+
+_worker_sim = None
+
+
+def _init_worker(parameters):
+    """工作进程初始化: 启动内核并设置固定参数"""
+    global _worker_sim
+    _worker_sim = NMRSimulator()
+    _worker_sim.connect()
+    for param, value in parameters.items():
+        _worker_sim.session.evaluate(wlexpr(f'{param} = {value}'))
+        _worker_sim.parameters[param] = value
+    Finalize(None, _worker_sim.disconnect, exitpriority=10)
+
+
+def _evaluate_chunk(task):
+    """在内核中一次求出整块样本的加权和"""
+    sequence, names, values, weights = task
+    sim = _worker_sim
+    block = NMRSimulator.param_block(names)
+    seq = NMRSimulator.sequence_expr(*sequence)
+    args = ', '.join(f'pomaEnsV{i}' for i in range(len(names)))
+    assign = '; '.join(f'{name} = pomaEnsV{i}' for i, name in enumerate(names))
+    rows = ', '.join(
+        '{' + ', '.join(wl_number(x) for x in (w, *row)) + '}'
+        for row, w in zip(values, weights)
+    )
+    sums = sim.session.evaluate(wlexpr(
+        f'Internal`InheritedBlock[{block}, Merge[Function[{{pomaEnsW, {args}}}, {assign}; '
+        f'pomaEnsW N[pomaTermRules[observable[{seq}]]]] @@@ {{{rows}}}, Total]]'
+    ))
+    return {term: complex(value) for term, value in sums.items()}, float(np.sum(weights)), len(weights)
+
+
+def ensemble_average(sequence, distributions, parameters=None, sim=None,
+                     workers=DEFAULT_WORKERS, chunk_size=DEFAULT_CHUNK, progress=print_progress):
+    """系综平均
+
+    sequence 为 (initial_state, steps)，distributions 为 {参数: Distribution}。
+    parameters 为工作进程内核中需要预先设置的固定参数。给出 sim 时先尝试
+    poma_codegen 生成的 NumPy 函数，在本进程内向量化求值；符号结果过大或
+    含无法翻译的函数时，与未给出 sim 一样把样本块分发给 workers 个工作进程。
+    progress(done, total, elapsed) 在每块完成后调用。
+
+    返回 {自旋算符项: 加权平均系数}。
+    """
+    names = list(distributions)
+    total = int(np.prod([len(d) for d in distributions.values()]))
+    chunks = iter_chunks(distributions, chunk_size)
+    average = StreamingAverage()
+    start = time.monotonic()
+
+    func = None
+    if sim is not None:
+        from poma_codegen import compile_observable
+        try:
+            func = compile_observable(sim, sequence, names, budget=SWEEP_LEAF_BUDGET)
+        except ValueError as e:
+            print(f"⚠️  无法生成 NumPy 函数: {e}")
+            func = None
+        if func is None:
+            print("   改为工作进程求值")
+
+    if func is not None:
+        for values, weights in chunks:
+            terms = func(*values.T)
+            average.add({term: np.dot(weights, value) for term, value in terms.items()},
+                        float(weights.sum()), len(weights))
+            if progress:
+                progress(average.count, total, time.monotonic() - start)
+        return average.result()
+
+    pool = multiprocessing.Pool(workers, initializer=_init_worker, initargs=(parameters or {},))
+    try:
+        tasks = ((sequence, names, values, weights) for values, weights in chunks)
+        for sums, weight, count in pool.imap_unordered(_evaluate_chunk, tasks):
+            average.add(sums, weight, count)
+            if progress:
+                progress(average.count, total, time.monotonic() - start)
+        pool.close()
+    except BaseException:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+
+    return average.result()
+
+
+def demo_b1_inhomogeneity():
+    """演示: B1 不均匀性下 90° 脉冲的平均信号"""
+    sequence = ('spin[1,z]', [("90° x 脉冲 (翻转角有分布)", "pulse[90 b1, x]")])
+    distributions = {'b1': Distribution.gaussian(1.0, 0.05, n=41)}
+    result = ensemble_average(sequence, distributions)
+    for term, value in result.items():
+        print(f"   {term}: {value}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(demo_b1_inhomogeneity())
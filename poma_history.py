@@ -0,0 +1,167 @@
+#!/usr/bin/env python3
+"""
+POMA 2.0 步骤历史存储
+内存有上限的历史记录: 最近的步骤保存在环形缓冲中，相同状态按内容哈希
+去重，状态以 zlib 压缩的二进制保存；超出预算的旧记录可溢写到磁盘
+(SQLite)，仍可按序号查询。同一个溢写文件可被多次运行复用，记录按会话区分。
+"""
+
+import uuid
+import zlib
+import sqlite3
+import hashlib
+from collections import deque
+
+# 默认内存预算 (字节)
+DEFAULT_BUDGET = 16 * 1024 * 1024
+
+# 每条记录除状态外的估算开销 (字节)
+RECORD_OVERHEAD = 200
+
+
+class StepHistory:
+    """有内存预算的步骤历史
+
+    记录按追加顺序编号 (index，从 1 开始)。迭代和按序号取值返回与旧版
+    history 列表相同的字典: step、description、command、result，另加 digest。
+    result 为调用方给出的结果文本 (NMRSimulator 传入的是内核侧截断的预览，
+    不是完整状态)；digest 为去重键: 给出 state (完整状态的哈希) 时用它，
+    否则用 result 文本的哈希。
+    溢写文件中的记录带会话标识 (self.session)，只有本会话的记录计入
+    len()、迭代和按序号取值；close() 时把内存中剩余的记录也写入文件。
+    """
+
+    def __init__(self, budget=DEFAULT_BUDGET, spill_path=None):
+        self.budget = budget
+        self.records = deque()
+        self.blobs = {}          # 摘要 -> [压缩数据, 引用计数]
+        self.memory = 0
+        self.count = 0
+        self.dropped = 0
+        self.spilled = 0
+        self.session = uuid.uuid4().hex
+        self.db = None
+        if spill_path:
+            self.db = sqlite3.connect(spill_path)
+            self.db.executescript('''
+                CREATE TABLE IF NOT EXISTS records (
+                    session TEXT, idx INTEGER, step INTEGER,
+                    description TEXT, command TEXT, digest TEXT,
+                    PRIMARY KEY (session, idx));
+                CREATE TABLE IF NOT EXISTS blobs (digest TEXT PRIMARY KEY, data BLOB);
+            ''')
+
+    def __len__(self):
+        return self.count
+
+    def append(self, step, description, command, result, state=None):
+        """追加一条记录，result 为结果文本，state 为可选的完整状态哈希"""
+        data = str(result).encode('utf-8')
+        digest = state or hashlib.sha1(data).hexdigest()
+
+        if digest in self.blobs:
+            self.blobs[digest][1] += 1
+        else:
+            blob = zlib.compress(data)
+            self.blobs[digest] = [blob, 1]
+            self.memory += len(blob)
+
+        self.count += 1
+        record = (self.count, step, description, command, digest)
+        self.records.append(record)
+        self.memory += self._record_size(record)
+
+        # 保留最新一条，淘汰更旧的记录直到回到预算内
+        while self.memory > self.budget and len(self.records) > 1:
+            self._evict(self.records.popleft())
+
+    def _record_size(self, record):
+        return RECORD_OVERHEAD + len(record[2]) + len(record[3])
+
+    def _evict(self, record, commit=True):
+        """把最旧的记录移出内存 (溢写到磁盘或丢弃)"""
+        digest = record[4]
+        if self.db is not None:
+            self.db.execute('INSERT OR IGNORE INTO blobs VALUES (?, ?)',
+                            (digest, self.blobs[digest][0]))
+            self.db.execute('INSERT OR REPLACE INTO records VALUES (?, ?, ?, ?, ?, ?)',
+                            (self.session, *record))
+            if commit:
+                self.db.commit()
+            self.spilled += 1
+        else:
+            self.dropped += 1
+
+        self.memory -= self._record_size(record)
+        entry = self.blobs[digest]
+        entry[1] -= 1
+        if entry[1] == 0:
+            self.memory -= len(entry[0])
+            del self.blobs[digest]
+
+    def _decode(self, record, blob):
+        index, step, description, command, digest = record
+        return {
+            'index': index,
+            'step': step,
+            'description': description,
+            'command': command,
+            'result': zlib.decompress(blob).decode('utf-8'),
+            'digest': digest,
+        }
+
+    def get(self, index):
+        """按序号取一条记录，已丢弃时返回 None"""
+        if self.records and self.records[0][0] <= index <= self.records[-1][0]:
+            record = self.records[index - self.records[0][0]]
+            return self._decode(record, self.blobs[record[4]][0])
+        if self.db is not None:
+            row = self.db.execute(
+                'SELECT r.idx, r.step, r.description, r.command, r.digest, b.data '
+                'FROM records r JOIN blobs b ON r.digest = b.digest '
+                'WHERE r.session = ? AND r.idx = ?',
+                (self.session, index)
+            ).fetchone()
+            if row:
+                return self._decode(row[:5], row[5])
+        return None
+
+    def __getitem__(self, index):
+        record = self.get(index)
+        if record is None:
+            raise IndexError(index)
+        return record
+
+    def __iter__(self):
+        """按顺序遍历全部可取得的记录 (先磁盘后内存)"""
+        if self.db is not None:
+            first = self.records[0][0] if self.records else self.count + 1
+            rows = self.db.execute(
+                'SELECT r.idx, r.step, r.description, r.command, r.digest, b.data '
+                'FROM records r JOIN blobs b ON r.digest = b.digest '
+                'WHERE r.session = ? AND r.idx < ? ORDER BY r.idx', (self.session, first)
+            )
+            for row in rows:
+                yield self._decode(row[:5], row[5])
+        for record in list(self.records):
+            yield self._decode(record, self.blobs[record[4]][0])
+
+    def stats(self):
+        """存储统计"""
+        return {
+            'total': self.count,
+            'in_memory': len(self.records),
+            'unique_states': len(self.blobs),
+            'memory_bytes': self.memory,
+            'spilled': self.spilled,
+            'dropped': self.dropped,
+        }
+
+    def close(self):
+        """关闭历史；有溢写文件时先把内存中的记录全部写入"""
+        if self.db is not None:
+            while self.records:
+                self._evict(self.records.popleft(), commit=False)
+            self.db.commit()
+            self.db.close()
+            self.db = None
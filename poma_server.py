@@ -0,0 +1,306 @@
+#!/usr/bin/env python3
+"""
+POMA 2.0 本地 HTTP/JSON 服务
+在一组已加载 POMA 的 Wolfram 内核之上提供 run-sequence、observable、
+raiselower 接口。相同的并发请求合并为一次计算，小请求打包成一次内核求值，
+队列满时返回 503 (背压)，/metrics 报告队列深度和延迟。
+
+注意: 请求中的代码会在内核中直接执行，服务默认只监听 127.0.0.1。
+"""
+
+import sys
+import json
+import time
+import queue
+import argparse
+import threading
+from collections import deque
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from wolframclient.language import wlexpr
+
+from run_poma_interactive import NMRSimulator
+from poma_session import wl_string
+
+# 默认配置
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_PORT = 8765
+DEFAULT_KERNELS = 2
+MAX_QUEUE = 256          # 排队请求上限，超过即返回 503
+MAX_BATCH = 32           # 单次内核求值最多合并的请求数
+BATCH_WINDOW = 0.005     # 收集同批请求的等待时间 (秒)
+REQUEST_TIMEOUT = 300    # 单个请求等待结果的最长时间 (秒)
+
+
+class ServiceBusy(Exception):
+    """队列已满"""
+
+
+class Metrics:
+    """服务指标"""
+
+    def __init__(self, window=1000):
+        self.lock = threading.Lock()
+        self.latencies = deque(maxlen=window)
+        self.requests = 0
+        self.coalesced = 0
+        self.rejected = 0
+        self.errors = 0
+        self.batches = 0
+        self.batched_items = 0
+
+    def add(self, name, count=1):
+        with self.lock:
+            setattr(self, name, getattr(self, name) + count)
+
+    def record_latency(self, seconds):
+        with self.lock:
+            self.latencies.append(seconds)
+
+    def snapshot(self, queue_depth, inflight):
+        with self.lock:
+            latencies = sorted(self.latencies)
+            data = {
+                'queue_depth': queue_depth,
+                'inflight': inflight,
+                'requests': self.requests,
+                'coalesced': self.coalesced,
+                'rejected': self.rejected,
+                'errors': self.errors,
+                'batches': self.batches,
+                'mean_batch_size': self.batched_items / self.batches if self.batches else 0.0,
+            }
+
+        def percentile(p):
+            if not latencies:
+                return None
+            return latencies[min(len(latencies) - 1, int(p * len(latencies)))] * 1000
+
+        data['latency_ms'] = {
+            'count': len(latencies),
+            'mean': sum(latencies) / len(latencies) * 1000 if latencies else None,
+            'p50': percentile(0.50),
+            'p95': percentile(0.95),
+            'max': latencies[-1] * 1000 if latencies else None,
+        }
+        return data
+
+
+class KernelPool:
+    """内核池: 合并相同请求、批量求值、背压"""
+
+    def __init__(self, kernels=DEFAULT_KERNELS, max_queue=MAX_QUEUE,
+                 max_batch=MAX_BATCH, batch_window=BATCH_WINDOW):
+        self.queue = queue.Queue(maxsize=max_queue)
+        self.max_batch = max_batch
+        self.batch_window = batch_window
+        self.metrics = Metrics()
+        self.inflight = {}
+        self.inflight_lock = threading.Lock()
+        self.simulators = []
+        self.threads = []
+
+        for _ in range(kernels):
+            sim = NMRSimulator()
+            sim.connect()
+            self.simulators.append(sim)
+            thread = threading.Thread(target=self._worker, args=(sim,), daemon=True)
+            thread.start()
+            self.threads.append(thread)
+
+    def submit(self, expr):
+        """提交一个 Wolfram 表达式，返回结果 Future
+
+        与正在计算的请求完全相同时直接共享其 Future。
+        """
+        self.metrics.add('requests')
+        with self.inflight_lock:
+            future = self.inflight.get(expr)
+            if future is not None:
+                self.metrics.add('coalesced')
+                return future
+
+            future = Future()
+            try:
+                self.queue.put_nowait((expr, future))
+            except queue.Full:
+                self.metrics.add('rejected')
+                raise ServiceBusy(f"队列已满 ({self.queue.maxsize})")
+            self.inflight[expr] = future
+
+        future.add_done_callback(lambda _: self._release(expr))
+        return future
+
+    def _release(self, expr):
+        with self.inflight_lock:
+            self.inflight.pop(expr, None)
+
+    def _collect_batch(self):
+        """阻塞取一个请求，再在时间窗口内尽量多取几个"""
+        batch = [self.queue.get()]
+        deadline = time.monotonic() + self.batch_window
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self.queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _worker(self, sim):
+        """工作线程: 每批请求只做一次内核求值"""
+        while True:
+            batch = self._collect_batch()
+            self.metrics.add('batches')
+            self.metrics.add('batched_items', len(batch))
+            try:
+                self._evaluate_batch(sim, batch)
+            except Exception as e:
+                # 任何意外都不能让工作线程退出，未完成的请求一律以错误结束
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+
+    def _evaluate_batch(self, sim, batch):
+        """一次内核求值完成一批请求
+
+        每项以字符串传入、在内核中单独解析并 Check，语法错误或括号不配对
+        只影响该项本身，不会破坏整批的解析或错位到其他请求。
+        """
+        items = ', '.join(
+            f'Quiet[Check[With[{{e = ToExpression[{wl_string(expr)}]}}, '
+            f'If[e === $Failed, $Failed, ToString[e, InputForm]]], $Failed]]'
+            for expr, _ in batch
+        )
+        try:
+            results = sim.session.evaluate(wlexpr(f'{{{items}}}'))
+        except Exception as e:
+            for _, future in batch:
+                future.set_exception(e)
+            return
+
+        if not isinstance(results, (list, tuple)) or len(results) != len(batch):
+            raise RuntimeError(f"内核返回的批量结果无效: {results!r}")
+
+        for (expr, future), result in zip(batch, results):
+            if isinstance(result, str):
+                future.set_result(result)
+            else:
+                future.set_exception(RuntimeError(f"内核求值失败: {expr}"))
+
+    def close(self):
+        for sim in self.simulators:
+            sim.disconnect()
+
+
+def block_with_params(expr, params):
+    """在临时参数赋值下求值，不影响内核中的全局参数"""
+    if not params:
+        return expr
+    assign = '; '.join(f'{name} = {value}' for name, value in params.items())
+    return f'Internal`InheritedBlock[{NMRSimulator.param_block(params)}, {assign}; {expr}]'
+
+
+def build_expression(endpoint, body):
+    """把请求体翻译成 Wolfram 表达式"""
+    if endpoint == '/run-sequence':
+        steps = [(step, step) if isinstance(step, str) else tuple(step) for step in body.get('steps', [])]
+        expr = NMRSimulator.sequence_expr(body['initial_state'], steps)
+        if body.get('observable'):
+            expr = f'observable[{expr}]'
+        return block_with_params(expr, body.get('params'))
+    if endpoint == '/observable':
+        return block_with_params(f'observable[{body["state"]}]', body.get('params'))
+    if endpoint == '/raiselower':
+        return block_with_params(f'raiselower[{body["state"]}]', body.get('params'))
+    return None
+
+
+def make_handler(pool):
+    """生成绑定到内核池的请求处理类"""
+
+    class Handler(BaseHTTPRequestHandler):
+
+        def _reply(self, status, data, headers=None):
+            payload = json.dumps(data, ensure_ascii=False).encode('utf-8')
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json; charset=utf-8')
+            self.send_header('Content-Length', str(len(payload)))
+            for key, value in (headers or {}).items():
+                self.send_header(key, value)
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def do_GET(self):
+            if self.path == '/metrics':
+                self._reply(200, pool.metrics.snapshot(pool.queue.qsize(), len(pool.inflight)))
+            elif self.path == '/health':
+                self._reply(200, {'status': 'ok', 'kernels': len(pool.simulators)})
+            else:
+                self._reply(404, {'error': f'未知路径: {self.path}'})
+
+        def do_POST(self):
+            start = time.monotonic()
+            try:
+                length = int(self.headers.get('Content-Length', 0))
+                body = json.loads(self.rfile.read(length) or b'{}')
+                if not isinstance(body, dict):
+                    raise ValueError('请求体必须是 JSON 对象')
+                expr = build_expression(self.path, body)
+            except (ValueError, KeyError, TypeError, AttributeError) as e:
+                self._reply(400, {'error': f'请求格式错误: {e}'})
+                return
+
+            if expr is None:
+                self._reply(404, {'error': f'未知路径: {self.path}'})
+                return
+
+            try:
+                result = pool.submit(expr).result(timeout=REQUEST_TIMEOUT)
+            except ServiceBusy as e:
+                self._reply(503, {'error': str(e)}, {'Retry-After': '1'})
+                return
+            except Exception as e:
+                pool.metrics.add('errors')
+                self._reply(500, {'error': str(e)})
+                return
+
+            elapsed = time.monotonic() - start
+            pool.metrics.record_latency(elapsed)
+            self._reply(200, {'result': result, 'elapsed_ms': elapsed * 1000})
+
+        def log_message(self, format, *args):
+            pass
+
+    return Handler
+
+
+def main():
+    parser = argparse.ArgumentParser(description='POMA 2.0 本地 HTTP/JSON 服务')
+    parser.add_argument('--host', default=DEFAULT_HOST)
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT)
+    parser.add_argument('--kernels', type=int, default=DEFAULT_KERNELS, help='内核数量')
+    parser.add_argument('--max-queue', type=int, default=MAX_QUEUE, help='排队上限')
+    parser.add_argument('--max-batch', type=int, default=MAX_BATCH, help='单批最大请求数')
+    args = parser.parse_args()
+
+    pool = KernelPool(args.kernels, args.max_queue, args.max_batch)
+    server = ThreadingHTTPServer((args.host, args.port), make_handler(pool))
+    print(f"🌐 POMA 服务已启动: http://{args.host}:{args.port}")
+    print("   POST /run-sequence  /observable  /raiselower")
+    print("   GET  /metrics  /health")
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("\n⚠️  用户中断")
+    finally:
+        server.server_close()
+        pool.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,175 @@
+#!/usr/bin/env python3
+"""
+POMA 2.0 内核会话管理
+- 预编译镜像: 首次加载 Poma2.m 后用 DumpSave 生成 .mx 镜像，之后直接
+  加载镜像；Poma2.m 内容或内核版本变化时自动重建。
+- 自动重连: 内核意外退出时从镜像重启，调用恢复回调 (参数、sigma 等)，
+  并重试出错的那一次求值；没有恢复回调时只重启，不重试。
+"""
+
+import os
+import json
+import hashlib
+from wolframclient.evaluation import WolframLanguageSession
+from wolframclient.language import wlexpr
+from wolframclient.language.expression import WLFunction
+
+# 镜像缓存目录，可用环境变量 POMA_CACHE_DIR 覆盖
+IMAGE_DIR = os.path.join(
+    os.environ.get('POMA_CACHE_DIR', os.path.join(os.path.expanduser('~'), '.cache', 'poma')),
+    'image'
+)
+
+# 内核退出后的最大重启次数 (每次求值)
+MAX_RESTARTS = 2
+
+
+def wl_string(s):
+    """Python 字符串转 Wolfram 字符串字面量"""
+    return '"' + s.replace('\\', '\\\\').replace('"', '\\"') + '"'
+
+
+def wl_number(x):
+    """Python 实数转 Wolfram 数字字面量 (2.5e-05 -> 2.5*^-05)"""
+    return repr(float(x)).replace('e+', '*^').replace('e', '*^')
+
+
+def load_poma(session, directory, image_dir=IMAGE_DIR):
+    """在会话中加载 POMA，优先使用预编译镜像
+
+    返回 'image' (从镜像加载) 或 'source' (从源码加载并重建镜像)。
+    """
+    session.evaluate(wlexpr(f'SetDirectory[{wl_string(directory)}]'))
+
+    source, digest, system = session.evaluate(wlexpr(
+        'With[{f = FindFile["Poma2`"]}, '
+        '{f, IntegerString[FileHash[f, "SHA256"], 16, 64], ToString[{$SystemID, $VersionNumber}]}]'
+    ))
+    # 记录源码哈希，供 poma_codegen 的缓存键使用
+    session.evaluate(wlexpr(f'pomaSourceHash = {wl_string(digest)};'))
+
+    key = hashlib.sha256(f'{digest}|{system}'.encode('utf-8')).hexdigest()[:16]
+    image = os.path.join(image_dir, f'Poma2-{key}.mx')
+    meta_path = os.path.join(image_dir, f'Poma2-{key}.json')
+
+    meta = None
+    if os.path.exists(image):
+        try:
+            with open(meta_path, encoding='utf-8') as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            meta = None
+
+    if meta and meta.get('hash') == digest and meta.get('system') == system:
+        context_path = '{' + ', '.join(wl_string(c) for c in meta['context_path']) + '}'
+        session.evaluate(wlexpr(
+            f'Get[{wl_string(image)}]; '
+            f'$ContextPath = DeleteDuplicates[Join[{context_path}, $ContextPath]];'
+        ))
+        return 'image'
+
+    # 从源码加载，同时记录新增的上下文
+    contexts, context_path = session.evaluate(wlexpr(
+        'With[{before = Contexts[], path = $ContextPath}, '
+        'Get["Poma2`"]; {Complement[Contexts[], before], Complement[$ContextPath, path]}]'
+    ))
+
+    # 先写临时文件再原子替换，并行启动的多个内核不会读到半个镜像
+    try:
+        os.makedirs(image_dir, exist_ok=True)
+        ctx_list = '{' + ', '.join(wl_string(c) for c in contexts) + '}'
+        tmp_image = os.path.join(image_dir, f'Poma2-{key}.{os.getpid()}.tmp.mx')
+        tmp_meta = f'{meta_path}.{os.getpid()}.tmp'
+        session.evaluate(wlexpr(f'DumpSave[{wl_string(tmp_image)}, {ctx_list}];'))
+        os.replace(tmp_image, image)
+        with open(tmp_meta, 'w', encoding='utf-8') as f:
+            json.dump({
+                'source': source,
+                'hash': digest,
+                'system': system,
+                'contexts': list(contexts),
+                'context_path': list(context_path),
+            }, f, indent=2, ensure_ascii=False)
+        os.replace(tmp_meta, meta_path)
+    except Exception as e:
+        # 镜像只是加速手段，生成失败不影响本次会话
+        print(f"⚠️  无法生成 POMA 镜像: {e}")
+
+    return 'source'
+
+
+class KernelSession:
+    """可自动重连的内核会话
+
+    接口与 WolframLanguageSession 的 evaluate/function/terminate 一致。
+    setup(session) 在每次启动并加载 POMA 后调用，用于加载无状态的辅助定义；
+    restore(session) 在内核重启后调用，用于恢复用户状态 (参数、sigma 等)。
+    只有给出 restore 时才重试出错的求值，否则重启后抛出 RuntimeError，
+    以免在丢失状态的内核上静默得到错误结果。
+    """
+
+    def __init__(self, kernel_path, directory, restore=None, setup=None,
+                 max_restarts=MAX_RESTARTS):
+        self.kernel_path = kernel_path
+        self.directory = directory
+        self.restore = restore
+        self.setup = setup
+        self.max_restarts = max_restarts
+        self.session = None
+        self.loaded_from = None
+        self.restarts = 0
+
+    def start(self):
+        """启动内核并加载 POMA"""
+        self.session = WolframLanguageSession(kernel=self.kernel_path)
+        self.session.start()
+        self.loaded_from = load_poma(self.session, self.directory)
+        if self.setup:
+            self.setup(self)
+        return self
+
+    def alive(self):
+        """内核是否仍可响应"""
+        if self.session is None:
+            return False
+        try:
+            return self.session.evaluate(wlexpr('1 + 1')) == 2
+        except Exception:
+            return False
+
+    def restart(self):
+        """重启内核、从镜像加载 POMA 并恢复状态"""
+        if self.session is not None:
+            try:
+                self.session.terminate()
+            except Exception:
+                pass
+        self.restarts += 1
+        print(f"🔄 内核已断开，正在重启 (第 {self.restarts} 次)...")
+        self.start()
+        if self.restore:
+            self.restore(self)
+        print(f"✅ 内核已恢复 (POMA 从{'镜像' if self.loaded_from == 'image' else '源码'}加载)")
+
+    def evaluate(self, expr, **kwargs):
+        """求值；内核退出时重启、恢复并重试 (无 restore 时重启后报错)"""
+        attempts = 0
+        while True:
+            try:
+                return self.session.evaluate(expr, **kwargs)
+            except Exception:
+                if attempts >= self.max_restarts or self.alive():
+                    raise
+                attempts += 1
+                self.restart()
+                if self.restore is None:
+                    raise RuntimeError("内核已重启，之前的定义 (参数、sigma 等) 已丢失，请重新执行")
+
+    def function(self, expr):
+        """返回调用时在内核中求值 expr[args] 的函数"""
+        return lambda *args: self.evaluate(WLFunction(expr, *args))
+
+    def terminate(self):
+        if self.session is not None:
+            self.session.terminate()
+            self.session = None
@@ -0,0 +1,226 @@
+#!/usr/bin/env python3
+"""
+POMA 2.0 大规模输出存储
+把二维实验、参数扫描等结果按块增量写入磁盘上的内存映射数组 (.npy)。
+目录结构:
+    meta.json       元数据头: 形状、分块、dtype、序列、参数、坐标轴 (及其哈希)、数组列表
+    progress.json   已完成的块 (数据落盘后再原子更新)
+    axis_<i>.npy    坐标轴
+    data_<k>.npy    每个结果数组一个文件 (如每个自旋算符项一个)
+数组沿第一维分块；中断后可从未完成的块继续；读取方以只读内存映射
+零拷贝打开，即使写入仍在进行。
+"""
+
+import os
+import json
+import hashlib
+import numpy as np
+from numpy.lib.format import open_memmap
+
+# 默认每块沿第一维的行数
+DEFAULT_CHUNK = 16
+
+# 默认数组类型: 可观测量系数一般为复数
+DEFAULT_DTYPE = 'complex128'
+
+STORE_VERSION = 1
+
+
+def _write_json(path, data):
+    """原子写入 JSON，读取方不会看到半个文件"""
+    tmp = f'{path}.{os.getpid()}.tmp'
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump(data, f, indent=2, ensure_ascii=False, default=str)
+    os.replace(tmp, path)
+
+
+def _axis_hash(values):
+    """坐标轴内容哈希 (含 dtype 和形状)，续算时用于确认网格未变"""
+    values = np.ascontiguousarray(values)
+    digest = hashlib.sha256(f'{values.dtype.str}|{values.shape}'.encode('utf-8'))
+    digest.update(values.tobytes())
+    return digest.hexdigest()
+
+
+def _read_json(path, default=None):
+    try:
+        with open(path, encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return default
+
+
+class OutputStore:
+    """分块内存映射输出存储"""
+
+    def __init__(self, path):
+        """打开已有的存储"""
+        self.path = path
+        self.meta = _read_json(os.path.join(path, 'meta.json'))
+        if self.meta is None:
+            raise FileNotFoundError(f"不是有效的输出存储: {path}")
+        self._maps = {}
+
+    @classmethod
+    def create(cls, path, shape, chunk=DEFAULT_CHUNK, axes=None, metadata=None,
+               dtype=DEFAULT_DTYPE):
+        """新建存储
+
+        shape 为每个结果数组的形状；axes 为 {坐标名: 数组}；metadata 为
+        序列、参数等描述信息 (需可 JSON 序列化)。所有结果数组都用 dtype 创建，
+        写入后不再改变，读取方打开的内存映射始终有效。
+        """
+        os.makedirs(path, exist_ok=True)
+        axis_files = {}
+        axis_hashes = {}
+        for i, (name, values) in enumerate((axes or {}).items()):
+            filename = f'axis_{i}.npy'
+            values = np.asarray(values)
+            np.save(os.path.join(path, filename), values)
+            axis_files[name] = filename
+            axis_hashes[name] = _axis_hash(values)
+
+        _write_json(os.path.join(path, 'progress.json'), {'completed': []})
+        _write_json(os.path.join(path, 'meta.json'), {
+            'version': STORE_VERSION,
+            'shape': [int(n) for n in shape],
+            'chunk': int(chunk),
+            'dtype': np.dtype(dtype).str,
+            'axes': axis_files,
+            'axis_hashes': axis_hashes,
+            'arrays': {},
+            'metadata': metadata or {},
+        })
+        return cls(path)
+
+    @classmethod
+    def open_or_create(cls, path, shape, chunk=DEFAULT_CHUNK, axes=None, metadata=None,
+                       dtype=DEFAULT_DTYPE):
+        """已存在且描述一致时打开 (用于续算)，否则新建
+
+        形状、分块、dtype、坐标轴内容和元数据任一不同都视为不一致，抛出 ValueError。
+        """
+        if os.path.exists(os.path.join(path, 'meta.json')):
+            store = cls(path)
+            expected = json.loads(json.dumps(metadata or {}, ensure_ascii=False, default=str))
+            axis_hashes = {name: _axis_hash(np.asarray(values))
+                           for name, values in (axes or {}).items()}
+            if (store.shape != tuple(shape) or store.chunk != int(chunk)
+                    or store.meta.get('dtype') != np.dtype(dtype).str
+                    or store.meta.get('axis_hashes') != axis_hashes
+                    or store.meta['metadata'] != expected):
+                raise ValueError(f"已有存储与本次运行不一致，请更换路径或删除: {path}")
+            return store
+        return cls.create(path, shape, chunk, axes, metadata, dtype)
+
+    # ---- 元数据 ----
+
+    @property
+    def shape(self):
+        return tuple(self.meta['shape'])
+
+    @property
+    def chunk(self):
+        return self.meta['chunk']
+
+    @property
+    def dtype(self):
+        return np.dtype(self.meta['dtype'])
+
+    @property
+    def metadata(self):
+        return self.meta['metadata']
+
+    @property
+    def n_chunks(self):
+        return -(-self.shape[0] // self.chunk)
+
+    def _reload_meta(self):
+        """重新读取元数据，以看到写入方新增的数组"""
+        self.meta = _read_json(os.path.join(self.path, 'meta.json'), self.meta)
+
+    @property
+    def names(self):
+        """结果数组名"""
+        if not self._maps:
+            self._reload_meta()
+        return list(self.meta['arrays'])
+
+    def axis(self, name):
+        return np.load(os.path.join(self.path, self.meta['axes'][name]), mmap_mode='r')
+
+    # ---- 进度 ----
+
+    def completed(self):
+        """已完成的块序号集合"""
+        progress = _read_json(os.path.join(self.path, 'progress.json'), {'completed': []})
+        return set(progress['completed'])
+
+    def pending_chunks(self):
+        """尚未完成的块序号"""
+        done = self.completed()
+        return [i for i in range(self.n_chunks) if i not in done]
+
+    def completed_rows(self):
+        """从开头起连续完成的行数，读取方可安全使用 [:rows]"""
+        done = self.completed()
+        i = 0
+        while i in done:
+            i += 1
+        return min(i * self.chunk, self.shape[0])
+
+    def is_complete(self):
+        return len(self.completed()) == self.n_chunks
+
+    def chunk_slice(self, index):
+        start = index * self.chunk
+        return slice(start, min(start + self.chunk, self.shape[0]))
+
+    # ---- 读写 ----
+
+    def _writable(self, name):
+        """取得 (必要时创建) 可写的内存映射数组"""
+        if name in self._maps:
+            return self._maps[name]
+
+        arrays = self.meta['arrays']
+        if name in arrays:
+            mm = open_memmap(os.path.join(self.path, arrays[name]), mode='r+')
+        else:
+            filename = f'data_{len(arrays)}.npy'
+            mm = open_memmap(os.path.join(self.path, filename), mode='w+',
+                             dtype=self.dtype, shape=self.shape)
+            arrays[name] = filename
+            _write_json(os.path.join(self.path, 'meta.json'), self.meta)
+        self._maps[name] = mm
+        return mm
+
+    def write_chunk(self, index, blocks):
+        """写入一个块: blocks 为 {数组名: 该块的数据}；数据落盘后才标记完成"""
+        rows = self.chunk_slice(index)
+        for name, block in blocks.items():
+            block = np.asarray(block)
+            if np.iscomplexobj(block) and self.dtype.kind != 'c' and np.any(block.imag):
+                raise ValueError(f"数组 {name} 为实数类型 ({self.dtype})，不能写入复数数据")
+            mm = self._writable(name)
+            mm[rows] = block.real if self.dtype.kind != 'c' else block
+            mm.flush()
+
+        progress_path = os.path.join(self.path, 'progress.json')
+        done = self.completed()
+        done.add(index)
+        _write_json(progress_path, {'completed': sorted(done)})
+
+    def array(self, name):
+        """只读、零拷贝地打开一个结果数组"""
+        if name not in self.meta['arrays']:
+            self._reload_meta()
+        return np.load(os.path.join(self.path, self.meta['arrays'][name]), mmap_mode='r')
+
+    def arrays(self):
+        return {name: self.array(name) for name in self.names}
+
+    def close(self):
+        for mm in self._maps.values():
+            mm.flush()
+        self._maps.clear()
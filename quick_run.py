@@ -6,9 +6,11 @@ POMA 2.0 快速运行脚本
 
 import sys
 import os
-from wolframclient.evaluation import WolframLanguageSession
 from wolframclient.language import wlexpr
 
+from poma_session import KernelSession, load_poma, wl_string
+from run_poma_interactive import KERNEL_HELPERS, DISPLAY_TERMS
+
 # 配置
 KERNEL_PATH = "/home/tony/wolfram/Executables/WolframKernel"
 os.environ['WOLFRAM_LICENSE_SERVER'] = 'mathematica.tsinghua.edu.cn'
@@ -38,20 +40,27 @@ def main():
 
     # 连接
     print("🔌 连接 Wolfram...")
-    session = WolframLanguageSession(kernel=KERNEL_PATH)
 
-    # 加载 POMA
+    # 加载 POMA (优先使用预编译镜像)，内核退出时自动重启
+    # 用户输入的定义无法追踪，重启后不重试，由用户重新执行
     current_dir = os.path.dirname(os.path.abspath(__file__))
-    session.evaluate(wlexpr(f'SetDirectory["{current_dir}"]'))
-    session.evaluate(wlexpr('<<Poma2`'))
+    session = KernelSession(
+        KERNEL_PATH, current_dir,
+        setup=lambda s: s.evaluate(wlexpr(KERNEL_HELPERS))
+    ).start()
     print("✅ 已就绪！\n")
 
     print("💡 提示:")
     print("   - 输入 'help' 查看示例")
+    print("   - 结果较长时只显示前几项，输入 'more' 查看后续")
     print("   - 输入 'quit' 或 'exit' 退出")
     print("   - 支持多行输入（以空行结束）")
     print()
 
+    # 上一个结果: [总项数, 已显示项数]
+    shown = [0, 0]
+    restarts = session.restarts
+
     # REPL 循环
     while True:
         try:
@@ -82,28 +91,45 @@ def main():
                 print_help()
                 continue
 
-            if code.lower() == 'reset':
-                session.evaluate(wlexpr('<<Poma2`'))
-                print("✅ POMA 已重置\n")
-                continue
-
-            # 执行代码
-            print()
             try:
-                result = session.evaluate(wlexpr(code))
+                if code.lower() == 'reset':
+                    load_poma(session, current_dir)
+                    shown[:] = [0, 0]
+                    print("✅ POMA 已重置\n")
+                    continue
+
+                if code.lower() == 'more':
+                    total, offset = shown
+                    if offset >= total:
+                        print("📭 没有更多项\n")
+                        continue
+                    terms = session.evaluate(wlexpr(f'pomaPage[{offset}, {DISPLAY_TERMS}]'))
+                    print_terms(terms, offset, total)
+                    shown[1] = offset + len(terms)
+                    continue
+
+                # 执行代码 (结果留在内核中，只取回项数和前几项)
+                print()
+                total, terms = session.evaluate(
+                    wlexpr(f'pomaPreview[ToExpression[{wl_string(code)}], {DISPLAY_TERMS}]')
+                )
+                shown[:] = [total, len(terms)]
 
                 # 显示结果
-                output = simplify_output(result)
-                if len(output) > 100:
-                    print("📤 结果:")
-                    for line in output.split(','):
-                        print(f"   {line.strip()}")
+                if total == 1 and len(terms[0]) <= 100:
+                    print(f"📤 {simplify_output(terms[0])}")
+                    print()
                 else:
-                    print(f"📤 {output}")
-                print()
+                    print(f"📤 结果 (共 {total} 项):")
+                    print_terms(terms, 0, total)
 
             except Exception as e:
                 print(f"❌ 错误: {e}\n")
+            finally:
+                # 内核重启后上一个结果已不在内核中，'more' 不再可用
+                if session.restarts != restarts:
+                    restarts = session.restarts
+                    shown[:] = [0, 0]
 
         except KeyboardInterrupt:
             print("\n\n使用 'quit' 退出\n")
@@ -112,6 +138,15 @@ def main():
     session.terminate()
     return 0
 
+def print_terms(terms, offset, total):
+    """逐项显示结果，并提示剩余项数"""
+    for i, term in enumerate(terms, offset + 1):
+        print(f"   [{i}] {simplify_output(term)}")
+    remaining = total - offset - len(terms)
+    if remaining > 0:
+        print(f"   … 还有 {remaining} 项，输入 'more' 查看")
+    print()
+
 def print_help():
     """打印帮助信息"""
     print()
@@ -7,13 +7,28 @@ POMA 2.0 美化版 NMR 仿真脚本
 import sys
 import os
 import re
-from wolframclient.evaluation import WolframLanguageSession
+import html
 from wolframclient.language import wl, wlexpr
 
+from poma_session import KernelSession
+from run_poma_interactive import NMRSimulator
+
 # WolframKernel 路径
 KERNEL_PATH = "/home/tony/wolfram/Executables/WolframKernel"
 os.environ['WOLFRAM_LICENSE_SERVER'] = 'mathematica.tsinghua.edu.cn'
 
+# 报告中显示的参数: (POMA 参数, 显示名, 单位)
+REPORT_PARAMS = [
+    ('j[1,2]', 'J₁₂', 'Hz'),
+    ('w[1]', 'ω₁', 'MHz'),
+    ('w[2]', 'ω₂', 'MHz'),
+]
+
+REPORT_FORMATS = ('markdown', 'latex', 'html')
+
+# LaTeX 正文中需要特殊写法的字符 (其余特殊字符前加反斜杠)
+LATEX_ESCAPES = {'\\': r'\textbackslash{}', '^': r'\^{}', '~': r'\~{}'}
+
 
 class NMRBeautifulOutput:
     """美化 NMR 输出"""
@@ -51,10 +66,8 @@ class NMRBeautifulOutput:
     def connect(self):
         """连接到 Wolfram"""
         print("🔌 正在连接 Wolfram Kernel...")
-        self.session = WolframLanguageSession(kernel=KERNEL_PATH)
         current_dir = os.path.realpath(os.path.dirname(__file__))
-        self.session.evaluate(wlexpr(f'SetDirectory["{current_dir}"]'))
-        self.session.evaluate(wlexpr('<<Poma2`'))
+        self.session = KernelSession(KERNEL_PATH, current_dir).start()
         print("✅ 已连接！POMA 2.0 已加载\n")
 
     def header(self, text, width=70):
@@ -192,6 +205,62 @@ class NMRBeautifulOutput:
         rl = self.session.evaluate(wlexpr('raiselower[sigma]'))
         print(f"   σ(升降算符) = {self.simplify_format(rl)}\n")
 
+    def evaluate_report(self, initial_state, steps, params=None, tex=False):
+        """一次内核求值得到整个序列的报告数据
+
+        返回 {'states', 'observable', 'raiselower', 'params'}：各步状态、
+        可观测信号、升降算符表示 (InputForm 或 TeXForm 字符串) 以及参数取值。
+        """
+        form = 'TeXForm' if tex else 'InputForm'
+        ops = ', '.join(f'Function[pomaS, {code}[pomaS]]' for _, code in steps)
+        names = [name for name, _, _ in REPORT_PARAMS]
+        values = ', '.join(f'If[NumericQ[{name}], ToString[{name}, InputForm], Null]' for name in names)
+        body = (
+            f'With[{{states = FoldList[#2[#1] &, {initial_state}, {{{ops}}}]}}, '
+            f'{{ToString[#, {form}] & /@ states, '
+            f'ToString[observable[Last[states]], {form}], '
+            f'ToString[raiselower[Last[states]], {form}], '
+            f'{{{values}}}}}]'
+        )
+        if params:
+            assign = '; '.join(f'{name} = {value}' for name, value in params.items())
+            body = f'Internal`InheritedBlock[{NMRSimulator.param_block(params)}, {assign}; {body}]'
+
+        states, observable, raiselower, param_values = self.session.evaluate(wlexpr(body))
+        return {
+            'states': list(states),
+            'observable': observable,
+            'raiselower': raiselower,
+            'params': [
+                (label, value, unit)
+                for (_, label, unit), value in zip(REPORT_PARAMS, param_values)
+                if isinstance(value, str)
+            ],
+        }
+
+    def report(self, sequences, path, fmt='markdown'):
+        """批量生成报告并逐个序列写入文件
+
+        sequences 为 [(标题, 初始状态, 步骤[, 参数])...]。每个序列只做一次
+        内核求值 (状态、参数和格式转换一起完成)。markdown 使用本地的
+        simplify_format 渲染，latex/html 使用内核的 TeXForm。
+        """
+        if fmt not in REPORT_FORMATS:
+            raise ValueError(f"未知报告格式: {fmt} (可选 {', '.join(REPORT_FORMATS)})")
+
+        writer = ReportWriter(fmt, self.simplify_format)
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(writer.begin())
+            for n, sequence in enumerate(sequences, 1):
+                title, initial_state, steps = sequence[:3]
+                params = sequence[3] if len(sequence) > 3 else None
+                data = self.evaluate_report(initial_state, steps, params, tex=fmt != 'markdown')
+                f.write(writer.sequence(title, initial_state, steps, data))
+                f.flush()
+                print(f"\r   📝 已写入 {n}/{len(sequences)}: {title}", end='', flush=True)
+            f.write(writer.end())
+        print(f"\n✅ 报告已保存: {path}\n")
+
     def close(self):
         """关闭连接"""
         if self.session:
@@ -199,6 +268,85 @@ class NMRBeautifulOutput:
             print("👋 连接已关闭\n")
 
 
+class ReportWriter:
+    """报告渲染: Markdown / LaTeX / HTML"""
+
+    def __init__(self, fmt, simplify):
+        self.fmt = fmt
+        self.simplify = simplify
+
+    def math(self, expr):
+        if self.fmt == 'markdown':
+            return f'`{self.simplify(expr)}`'
+        if self.fmt == 'latex':
+            return f'${expr}$'
+        return f'\\({html.escape(expr)}\\)'
+
+    def text(self, s):
+        if self.fmt == 'latex':
+            return re.sub(r'[&%$#_{}\\^~]', lambda m: LATEX_ESCAPES.get(m.group(), '\\' + m.group()), s)
+        if self.fmt == 'html':
+            return html.escape(s)
+        return s
+
+    def begin(self):
+        if self.fmt == 'latex':
+            return ('\\documentclass{ctexart}\n\\usepackage{amsmath}\n'
+                    '\\begin{document}\n\\section*{POMA 2.0 仿真报告}\n')
+        if self.fmt == 'html':
+            return ('<!DOCTYPE html>\n<html><head><meta charset="utf-8">\n'
+                    '<title>POMA 2.0 仿真报告</title>\n'
+                    '<script src="https://cdn.jsdelivr.net/npm/mathjax@3/es5/tex-chtml.js"></script>\n'
+                    '</head><body>\n<h1>POMA 2.0 仿真报告</h1>\n')
+        return '# POMA 2.0 仿真报告\n\n'
+
+    def end(self):
+        if self.fmt == 'latex':
+            return '\\end{document}\n'
+        if self.fmt == 'html':
+            return '</body></html>\n'
+        return ''
+
+    def sequence(self, title, initial_state, steps, data):
+        """渲染一个序列"""
+        rows = [('初始状态', initial_state, data['states'][0])]
+        rows += [(desc, code, state) for (desc, code), state in zip(steps, data['states'][1:])]
+        params = ', '.join(f'{label} = {value} {unit}' for label, value, unit in data['params'])
+
+        if self.fmt == 'latex':
+            out = [f'\\subsection*{{{self.text(title)}}}\n']
+            if params:
+                out.append(f'参数: {self.text(params)}\n\n')
+            out.append('\\begin{enumerate}\n')
+            for desc, code, state in rows:
+                out.append(f'\\item {self.text(desc)}: \\texttt{{{self.text(code)}}}\\\\ {self.math(state)}\n')
+            out.append('\\end{enumerate}\n')
+            out.append(f'可观测信号: {self.math(data["observable"])}\n\n')
+            out.append(f'升降算符表示: {self.math(data["raiselower"])}\n\n')
+            return ''.join(out)
+
+        if self.fmt == 'html':
+            out = [f'<h2>{self.text(title)}</h2>\n']
+            if params:
+                out.append(f'<p>参数: {self.text(params)}</p>\n')
+            out.append('<ol>\n')
+            for desc, code, state in rows:
+                out.append(f'<li>{self.text(desc)}: <code>{self.text(code)}</code><br>{self.math(state)}</li>\n')
+            out.append('</ol>\n')
+            out.append(f'<p>可观测信号: {self.math(data["observable"])}</p>\n')
+            out.append(f'<p>升降算符表示: {self.math(data["raiselower"])}</p>\n')
+            return ''.join(out)
+
+        out = [f'## {title}\n\n']
+        if params:
+            out.append(f'参数: {params}\n\n')
+        for i, (desc, code, state) in enumerate(rows):
+            out.append(f'{i}. {desc} (`{code}`)\n   σ = {self.math(state)}\n')
+        out.append(f'\n- 可观测信号: {self.math(data["observable"])}\n')
+        out.append(f'- 升降算符表示: {self.math(data["raiselower"])}\n\n')
+        return ''.join(out)
+
+
 def demo_hsqc():
     """HSQC 演示"""
     sim = NMRBeautifulOutput()
@@ -240,6 +388,35 @@ def demo_simple():
     sim.close()
 
 
+def demo_report():
+    """报告演示: 一次生成多个序列的报告"""
+    sim = NMRBeautifulOutput()
+    sim.connect()
+
+    fmt = input("报告格式 (markdown/latex/html，默认 markdown): ").strip() or 'markdown'
+    path = {'markdown': 'poma_report.md', 'latex': 'poma_report.tex', 'html': 'poma_report.html'}.get(fmt)
+
+    sequences = [
+        ("简单脉冲序列", "spin[1,z]", [
+            ("90°x 脉冲", "pulse[90, x]"),
+            ("延迟 0.1 秒", "delay[0.1]"),
+        ]),
+        ("HSQC 脉冲序列", "spin[1,z] spin[2,z]", [
+            ("90°x 脉冲作用于 ¹H", "pulse[90, x, {1}]"),
+            ("演化时间 τ = 1/(4J)", "delay[1/(4*140), {{1,2}}]"),
+            ("180°x 脉冲作用于所有自旋", "pulse[180, x]"),
+            ("演化时间 τ = 1/(4J)", "delay[1/(4*140), {{1,2}}]"),
+            ("90°y 脉冲作用于 X 核", "pulse[90, y, {2}]"),
+        ], {'j[1,2]': 140, 'w[1]': 500, 'w[2]': 50}),
+    ]
+
+    try:
+        sim.report(sequences, path or 'poma_report.txt', fmt)
+    except ValueError as e:
+        print(f"❌ {e}")
+    sim.close()
+
+
 def main():
     print("="*70)
     print("  🧪 POMA 2.0 - NMR 脉冲序列仿真 (美化版)")
@@ -249,17 +426,20 @@ def main():
     print("📋 可用示例:")
     print("   1️⃣  简单的 90° 脉冲序列")
     print("   2️⃣  HSQC (异核单量子相干) 序列")
-    print("   3️⃣  退出")
+    print("   3️⃣  生成报告 (Markdown/LaTeX/HTML)")
+    print("   4️⃣  退出")
     print()
 
     try:
-        choice = input("请选择 (1-3): ").strip()
+        choice = input("请选择 (1-4): ").strip()
 
         if choice == '1':
             demo_simple()
         elif choice == '2':
             demo_hsqc()
         elif choice == '3':
+            demo_report()
+        elif choice == '4':
             print("👋 再见!")
             return 0
         else:
@@ -6,34 +6,171 @@ POMA 2.0 交互式 NMR 仿真脚本
 
 import sys
 import os
-from wolframclient.evaluation import WolframLanguageSession
+import re
+import shutil
+import tempfile
 from wolframclient.language import wl, wlexpr
 
+from poma_history import StepHistory, DEFAULT_BUDGET
+from poma_session import KernelSession, wl_number, wl_string
+
 # WolframKernel 路径
 KERNEL_PATH = "/home/tony/wolfram/Executables/WolframKernel"
 
 # 设置许可证服务器
 os.environ['WOLFRAM_LICENSE_SERVER'] = 'mathematica.tsinghua.edu.cn'
 
+# 参数扫描: 符号可观测量的 LeafCount 超过此值时退回逐点数值计算
+SWEEP_LEAF_BUDGET = 20000
+
+# 重复块: 次数不超过此值时直接嵌套求值，否则用块传播矩阵的幂
+REPEAT_NEST_LIMIT = 2
+
+# 输出显示: 内核侧只返回前若干项，其余按页获取；单项超过字符上限时截断
+DISPLAY_TERMS = 20
+TERM_CHARS = 400
+
+# 内核侧辅助函数
+#   pomaPreview/pomaPage: 结果保存在内核中，只传回项数和前 n 项
+#   pomaCheckpoint/pomaStateStep: sigma 压缩写入检查点；后者同时返回预览和状态哈希
+#   pomaTermOps/pomaTermRules: 把表达式拆成 {自旋算符项 -> 系数}
+#   pomaFreeSymbols: 数值求值后仍为符号的系数中出现的符号名
+#   pomaRepeat: 重复块，块对每个算符的作用在一次调用内只计算一次，
+#               再用 MatrixPower (平方求幂) 作用 n 次
+KERNEL_HELPERS = r'''
+pomaTermString[t_] := With[{s = ToString[t, InputForm]},
+    If[StringLength[s] > ''' + str(TERM_CHARS) + r''', StringTake[s, ''' + str(TERM_CHARS) + r'''] <> " \[Ellipsis]", s]];
+pomaPreview[e_, n_Integer] := (
+    pomaLast = e;
+    pomaLastTerms = If[Head[e] === Plus, List @@ e, {e}];
+    {Length[pomaLastTerms], pomaTermString /@ Take[pomaLastTerms, UpTo[n]]});
+pomaPage[offset_Integer, n_Integer] := pomaTermString /@
+    Take[pomaLastTerms, {Min[offset + 1, Length[pomaLastTerms] + 1], Min[offset + n, Length[pomaLastTerms]]}];
+pomaCheckpoint[file_String] := If[ValueQ[sigma], Put[Compress[sigma], file]; True, False];
+pomaStateStep[n_Integer, file_String] := (
+    pomaCheckpoint[file];
+    Append[pomaPreview[sigma, n], IntegerString[Hash[sigma, "SHA256"], 16, 64]]);
+
+pomaTermOps[e_] := With[{ex = Expand[e]},
+    Merge[
+        Function[t, With[{ops = Times @@ Cases[If[Head[t] === Times, List @@ t, {t}], _spin | Power[_spin, _]]},
+            ops -> t/ops]] /@ If[Head[ex] === Plus, List @@ ex, {ex}],
+        Total]];
+pomaTermRules[e_] := KeyMap[ToString[#, InputForm] &, pomaTermOps[e]];
+pomaFreeSymbols[e_] := If[AllTrue[Flatten[{e}], NumericQ], {},
+    With[{free = Union[SymbolName /@ Cases[e, s_Symbol /; Context[s] === "Global`" && !NumericQ[s], {0, Infinity}, Heads -> True]]},
+        If[free === {}, {ToString[SelectFirst[Flatten[{e}], !NumericQ[#] &], InputForm]}, free]]];
+
+pomaDependencyKey[names_List] := ToString[{pomaSourceHash, Hash[Function[n,
+    With[{full = "Global`" <> n},
+        If[NameQ[full], ToExpression[full, InputForm, Function[s, {OwnValues[s], DownValues[s], SubValues[s]}, HoldAll]], {}]]] /@ names]}];
+
+pomaRepeat[f_, n_Integer][s_] := pomaRepeat[f, n, s];
+pomaRepeat[f_, n_Integer, s_] /; n <= ''' + str(REPEAT_NEST_LIMIT) + r''' := Nest[f, s, n];
+pomaRepeat[f_, n_Integer, s_] := Module[{image = <||>, state = pomaTermOps[s], basis, i = 1, m, op},
+    basis = Keys[state];
+    While[i <= Length[basis],
+        op = basis[[i]];
+        image[op] = pomaTermOps[f[op]];
+        basis = Join[basis, Complement[Keys[image[op]], basis]];
+        i++];
+    m = Transpose[Lookup[image[#], basis, 0] & /@ basis];
+    Expand[basis . (MatrixPower[m, n] . Lookup[state, basis, 0])]];
+'''
+
+
+class Preview:
+    """内核侧截断后的结果: 总项数和已取回的前几项"""
+
+    def __init__(self, total, terms, state=None):
+        self.total = total
+        self.terms = list(terms)
+        # 完整状态的哈希 (内核计算)，只有更新 sigma 的步骤才有
+        self.state = state
+
+    @property
+    def remaining(self):
+        return self.total - len(self.terms)
+
+    def __str__(self):
+        text = ' + '.join(self.terms)
+        if self.remaining > 0:
+            text += f' + … (共 {self.total} 项)'
+        return text
+
+
+def repeat(n, block, description=None):
+    """重复块步骤
+
+    block 为 [(描述, 代码), ...]，返回可直接放入 steps 的 (描述, 代码)。
+    块的作用只计算一次，n 次重复在内核中通过矩阵幂完成，只需一次往返。
+    """
+    inner = NMRSimulator.sequence_expr('pomaRepeatState', block)
+    if description is None:
+        description = f"重复 {n} 次: " + ", ".join(desc for desc, _ in block)
+    return description, f'pomaRepeat[Function[pomaRepeatState, {inner}], {int(n)}]'
+
 
 class NMRSimulator:
     """NMR 仿真器类"""
 
-    def __init__(self):
+    def __init__(self, history_budget=DEFAULT_BUDGET, history_path=None):
         self.session = None
         self.step_count = 0
-        self.history = []
+        # history_budget: 历史记录内存上限 (字节)；history_path: 溢写用的 SQLite 文件
+        self.history = StepHistory(history_budget, history_path)
+        self.parameters = {}
+        # sigma 检查点: 每次 sigma 变化后由内核压缩写入磁盘，两个文件交替
+        # 使用，self._checkpoint 指向最近一次完整写入的文件，内核重启后从它恢复
+        self._checkpoint_dir = None
+        self._checkpoint = None
+        self.last_preview = None
+        self._helpers_loaded = False
 
     def connect(self):
         """连接到 Wolfram Kernel"""
         print("🔌 连接到 Wolfram Kernel...")
-        self.session = WolframLanguageSession(kernel=KERNEL_PATH)
 
-        # 设置工作目录并加载 POMA
+        # 设置工作目录并加载 POMA (优先使用预编译镜像)，内核退出时自动重连
         current_dir = os.path.realpath(os.path.dirname(__file__))
-        self.session.evaluate(wlexpr(f'SetDirectory["{current_dir}"]'))
-        self.session.evaluate(wlexpr('<<Poma2`'))
-        print("✅ 连接成功！POMA 已加载\n")
+        self.session = KernelSession(KERNEL_PATH, current_dir, restore=self._restore_state)
+        self.session.start()
+        self._helpers_loaded = False
+        self._ensure_helpers()
+        source = '镜像' if self.session.loaded_from == 'image' else '源码'
+        print(f"✅ 连接成功！POMA 已加载 (来自{source})\n")
+
+    def _restore_state(self, session):
+        """内核重启后恢复辅助函数、参数和 sigma"""
+        session.evaluate(wlexpr(KERNEL_HELPERS))
+        self._helpers_loaded = True
+        for param, value in self.parameters.items():
+            session.evaluate(wlexpr(f'{param} = {value}'))
+        if self._checkpoint:
+            session.evaluate(wlexpr(f'sigma = Uncompress[Get[{wl_string(self._checkpoint)}]];'))
+
+    def _next_checkpoint(self):
+        """下一次检查点写入的文件 (与最近一次完整的检查点交替)"""
+        if self._checkpoint_dir is None:
+            self._checkpoint_dir = tempfile.mkdtemp(prefix='poma_sigma_')
+        return os.path.join(
+            self._checkpoint_dir,
+            'b.wl' if self._checkpoint and self._checkpoint.endswith('a.wl') else 'a.wl'
+        )
+
+    def _ensure_helpers(self):
+        """按需在内核中定义辅助函数"""
+        if not self._helpers_loaded:
+            self.session.evaluate(wlexpr(KERNEL_HELPERS))
+            self._helpers_loaded = True
+
+    @staticmethod
+    def sequence_expr(initial_state, steps):
+        """把序列拼成一个嵌套的 Wolfram 表达式，一次求值即可"""
+        expr = f'({initial_state})'
+        for _, step_cmd in steps:
+            expr = f'{step_cmd}[{expr}]'
+        return expr
 
     def print_separator(self, title=""):
         """打印分隔线"""
@@ -44,8 +181,46 @@ class NMRSimulator:
         else:
             print(f"{'-'*60}\n")
 
-    def execute_step(self, description, command, show_input=True, show_output=True):
-        """执行一步并显示输入输出"""
+    def preview(self, command, limit=DISPLAY_TERMS, checkpoint=False):
+        """在内核中求值，只取回项数和前 limit 项；完整结果保留在内核的 pomaLast
+
+        checkpoint=True 用于更新 sigma 的命令: 求值、写检查点和取预览在同一次
+        内核求值中完成，内核中途退出时整体重试，不会把旧状态记为最新检查点。
+        """
+        self._ensure_helpers()
+        if checkpoint:
+            target = self._next_checkpoint()
+            total, terms, state = self.session.evaluate(wlexpr(
+                f'({command}); pomaStateStep[{int(limit)}, {wl_string(target)}]'
+            ))
+            self._checkpoint = target
+            self.last_preview = Preview(total, terms, state)
+        else:
+            total, terms = self.session.evaluate(wlexpr(f'pomaPreview[({command}), {int(limit)}]'))
+            self.last_preview = Preview(total, terms)
+        return self.last_preview
+
+    def more(self, limit=DISPLAY_TERMS):
+        """显示上一个结果的下一页"""
+        preview = self.last_preview
+        if preview is None or preview.remaining <= 0:
+            print("   (没有更多项)")
+            return []
+        offset = len(preview.terms)
+        terms = self.session.evaluate(wlexpr(f'pomaPage[{offset}, {int(limit)}]'))
+        preview.terms.extend(terms)
+        for i, term in enumerate(terms, offset + 1):
+            print(f"   [{i}] {term}")
+        if preview.remaining > 0:
+            print(f"   … 还有 {preview.remaining} 项")
+        return terms
+
+    def execute_step(self, description, command, show_input=True, show_output=True, fetch=False):
+        """执行一步并显示输入输出
+
+        输出只在内核侧截断后传回；fetch=True 时额外取回完整结果并返回，
+        否则返回 Preview。出错时返回 None。
+        """
         self.step_count += 1
 
         print(f"📍 步骤 {self.step_count}: {description}")
@@ -56,30 +231,43 @@ class NMRSimulator:
             print(f"   {command}")
             print()
 
+        # 赋值 sigma 的命令同时写检查点，供内核重启后恢复
+        assignment = re.match(r'\s*([A-Za-z$][\w$]*(?:\[[^\]]*\])?)\s*=(?!=)\s*(.+)$', command, re.S)
+        target, value = assignment.groups() if assignment else (None, None)
+
         # 执行命令
         try:
-            result = self.session.evaluate(wlexpr(command))
+            preview = self.preview(command, checkpoint=target == 'sigma')
 
             if show_output:
                 print("📤 输出结果:")
-                self.format_output(result)
+                self.format_output(preview)
                 print()
 
-            # 保存历史
-            self.history.append({
-                'step': self.step_count,
-                'description': description,
-                'command': command,
-                'result': str(result)
-            })
+            # 记录参数赋值，供内核重启后恢复
+            if target and re.match(r'[jw]\[', target):
+                self.parameters[target] = value.strip()
 
-            return result
+            # 保存历史 (sigma 步骤按完整状态的哈希去重)
+            self.history.append(self.step_count, description, command, preview, state=preview.state)
+
+            if fetch:
+                return self.session.evaluate(wlexpr('pomaLast'))
+            return preview
         except Exception as e:
             print(f"❌ 错误: {e}")
             return None
 
     def format_output(self, result):
         """格式化输出结果"""
+        if isinstance(result, Preview):
+            if result.total > len(result.terms):
+                for i, term in enumerate(result.terms, 1):
+                    print(f"   [{i}] {term}")
+                print(f"   … 共 {result.total} 项，已显示 {len(result.terms)} 项 (sim.more() 查看更多)")
+                return
+            result = ' + '.join(result.terms)
+
         result_str = str(result)
 
         # 如果结果很长，分行显示
@@ -100,6 +288,7 @@ class NMRSimulator:
                 show_input=False,
                 show_output=False
             )
+            self.parameters[param] = value
             print(f"   ✅ {param} = {value}")
 
         print()
@@ -132,19 +321,21 @@ class NMRSimulator:
             print(f"   sigma = {step_cmd}[sigma]")
             print()
 
-            # 执行步骤
-            current_state = self.session.evaluate(wlexpr(f'{step_cmd}[sigma]'))
+            # 执行步骤并更新 sigma (状态留在内核中，只取回预览)
+            self.step_count += 1
+            command = f'sigma = {step_cmd}[sigma]'
+            current_state = self.preview(command, checkpoint=True)
 
             print("📊 当前状态:")
             self.format_output(current_state)
             print()
 
-            # 更新 sigma
-            self.session.evaluate(wlexpr('sigma = %s' % current_state))
+            self.history.append(self.step_count, step_desc, command, current_state,
+                                state=current_state.state)
 
         self.print_separator("✅ 序列仿真完成")
 
-    def get_observable(self, state=None):
+    def get_observable(self, state=None, fetch=False):
         """获取可观测信号"""
         self.print_separator("📡 可观测信号")
 
@@ -152,18 +343,20 @@ class NMRSimulator:
             result = self.execute_step(
                 "提取可观测磁化",
                 f'observable[{state}]',
-                show_input=False
+                show_input=False,
+                fetch=fetch
             )
         else:
             result = self.execute_step(
                 "提取可观测磁化",
                 'observable[sigma]',
-                show_input=False
+                show_input=False,
+                fetch=fetch
             )
 
         return result
 
-    def show_raiselower(self, state=None):
+    def show_raiselower(self, state=None, fetch=False):
         """转换为升降算符表示"""
         self.print_separator("⬆️⬇️ 升降算符表示")
 
@@ -171,26 +364,203 @@ class NMRSimulator:
             result = self.execute_step(
                 "转换为升降算符",
                 f'raiselower[{state}]',
-                show_input=False
+                show_input=False,
+                fetch=fetch
             )
         else:
             result = self.execute_step(
                 "转换为升降算符",
                 'raiselower[sigma]',
-                show_input=False
+                show_input=False,
+                fetch=fetch
             )
 
         return result
 
+    @staticmethod
+    def param_block(names):
+        """参数名对应的 InheritedBlock 头部列表，如 j[1,2] -> {j}"""
+        heads = sorted({re.match(r'\s*([A-Za-z$][\w$]*)', name).group(1) for name in names})
+        return '{' + ', '.join(heads) + '}'
+
+    def dependency_key(self, sequence, params):
+        """序列依赖的内核状态摘要: Poma2.m 哈希以及序列中非扫描符号 (含 j、w) 的取值"""
+        initial_state, steps = sequence
+        text = ' '.join([initial_state] + [cmd for _, cmd in steps])
+        swept = {re.match(r'\s*([A-Za-z$][\w$]*)', name).group(1) for name in params}
+        names = sorted((set(re.findall(r'[A-Za-z$][\w$]*', text)) - swept) | {'j', 'w'})
+        self._ensure_helpers()
+        return self.session.evaluate(wlexpr(
+            'pomaDependencyKey[{' + ', '.join(f'"{name}"' for name in names) + '}]'
+        ))
+
+    def symbolic_observable(self, sequence, params, budget=SWEEP_LEAF_BUDGET):
+        """以 params 为符号运行序列一次，返回可观测量的表达式树
+
+        返回 (内核变量名列表, {自旋算符项: 系数表达式}, FullForm 字符串)；
+        LeafCount 超过 budget 时返回 None，表达式不传回 Python。
+        """
+        initial_state, steps = sequence
+        names = list(params)
+        self._ensure_helpers()
+        block = self.param_block(names)
+        unset = '; '.join(f'Quiet[{name} =.]' for name in names)
+        variables = [f'pomaSweepVar{i}' for i in range(len(names))]
+        rules = '{' + ', '.join(f'{name} -> {var}' for name, var in zip(names, variables)) + '}'
+        seq = self.sequence_expr(initial_state, steps)
+
+        leaves = self.session.evaluate(wlexpr(
+            f'Internal`InheritedBlock[{block}, {unset}; '
+            f'pomaSweepObs = pomaTermRules[observable[{seq}]] /. {rules}]; '
+            f'LeafCount[pomaSweepObs]'
+        ))
+        if budget is not None and leaves > budget:
+            print(f"⚠️  符号结果过大 (LeafCount={leaves})")
+            return None
+
+        terms, fullform = self.session.evaluate(
+            wlexpr('{pomaSweepObs, ToString[FullForm[pomaSweepObs]]}')
+        )
+        return variables, terms, fullform
+
+    def _sweep_points(self, seq, block, names, axes):
+        """逐点数值计算，返回 {自旋算符项: 复数数组}
+
+        系数中仍有未赋值的符号 (既不扫描也未设置) 时抛出 ValueError。
+        """
+        import numpy as np
+
+        shape = tuple(len(axis) for axis in axes)
+        result = {}
+        for index in np.ndindex(*shape):
+            assign = '; '.join(
+                f'{name} = {wl_number(axis[i])}' for name, axis, i in zip(names, axes, index)
+            )
+            point, free = self.session.evaluate(wlexpr(
+                f'Internal`InheritedBlock[{block}, {assign}; '
+                f'With[{{r = N[pomaTermRules[observable[{seq}]]]}}, {{r, pomaFreeSymbols[Values[r]]}}]]'
+            ))
+            if free:
+                raise ValueError(f"系数中含未赋值的符号: {', '.join(free)}，请在 params 中扫描或先设置")
+            for term, value in point.items():
+                if term not in result:
+                    result[term] = np.zeros(shape, dtype=complex)
+                result[term][index] = complex(value)
+        return result
+
+    def sweep(self, sequence, params, budget=SWEEP_LEAF_BUDGET, store=None, chunk=None):
+        """参数扫描
+
+        sequence 为 (initial_state, steps)，params 为 {参数: 数组}。
+        扫描参数在内核中保持符号形式，序列只运行一次，可观测量经
+        poma_codegen 生成 NumPy 函数 (磁盘缓存) 后在整个网格上一次求值。
+        符号结果超过 budget (LeafCount) 时退回逐点计算。
+
+        返回 {自旋算符项: ndarray}，数组形状为各参数数组长度组成的网格，
+        虚部可忽略时为实数数组 (np.real_if_close)。给出 store (目录) 时结果沿
+        第一个参数分块写入 poma_store.OutputStore，中断后以相同参数再次调用会
+        从未完成的块继续，返回只读内存映射数组，其类型总是复数 (complex128)。
+        """
+        import numpy as np
+        from poma_codegen import compile_observable
+
+        initial_state, steps = sequence
+        names = list(params)
+        axes = [np.asarray(params[name], dtype=float).ravel() for name in names]
+        shape = tuple(len(axis) for axis in axes)
+
+        try:
+            func = compile_observable(self, sequence, names, budget=budget)
+        except ValueError as e:
+            print(f"⚠️  无法生成 NumPy 函数: {e}")
+            func = None
+        if func is None:
+            print("   改为逐点计算")
+            self._ensure_helpers()
+            block = self.param_block(names)
+            seq = self.sequence_expr(initial_state, steps)
+
+        def evaluate(sub_axes):
+            if func is not None:
+                grids = np.meshgrid(*sub_axes, indexing='ij')
+                return {term: np.array(value) for term, value in func(*grids).items()}
+            return self._sweep_points(seq, block, names, sub_axes)
+
+        if store is None:
+            return {term: np.real_if_close(value) for term, value in evaluate(axes).items()}
+
+        # 分块写入磁盘，支持续算
+        from poma_store import OutputStore, DEFAULT_CHUNK
+        output = OutputStore.open_or_create(
+            store, shape, chunk or DEFAULT_CHUNK,
+            axes=dict(zip(names, axes)),
+            metadata={
+                'kind': 'sweep',
+                'sequence': [initial_state, [list(step) for step in steps]],
+                'params': names,
+                'parameters': self.parameters,
+            },
+        )
+        pending = output.pending_chunks()
+        if len(pending) < output.n_chunks:
+            print(f"   ⏩ 续算: 已完成 {output.n_chunks - len(pending)}/{output.n_chunks} 块")
+        for index in pending:
+            rows = output.chunk_slice(index)
+            output.write_chunk(index, evaluate([axes[0][rows]] + axes[1:]))
+            print(f"\r   💾 已写入块 {index + 1}/{output.n_chunks}", end='', flush=True)
+        if pending:
+            print()
+        output.close()
+        return output.arrays()
+
+    def ensemble(self, sequence, distributions, **options):
+        """系综平均，参见 poma_ensemble.ensemble_average"""
+        from poma_ensemble import ensemble_average
+        return ensemble_average(sequence, distributions, parameters=self.parameters,
+                                sim=self, **options)
+
     def show_summary(self):
         """显示仿真摘要"""
         self.print_separator("📋 仿真摘要")
 
+        stats = self.history.stats()
         print(f"总步骤数: {self.step_count}")
-        print(f"历史记录: {len(self.history)} 条\n")
+        print(f"历史记录: {len(self.history)} 条")
+        print(f"   内存中: {stats['in_memory']} 条, {stats['unique_states']} 个不同状态, "
+              f"{stats['memory_bytes'] / 1024:.1f} KB")
+        if stats['spilled']:
+            print(f"   已溢写到磁盘: {stats['spilled']} 条")
+        if stats['dropped']:
+            print(f"   超出预算已丢弃: {stats['dropped']} 条")
+        print()
+
+    def replay(self, start=1, stop=None):
+        """按历史记录重新执行命令，返回最后一条的结果"""
+        if self.history.dropped >= start:
+            print(f"⚠️  前 {self.history.dropped} 条历史已丢弃，无法完整重放")
+
+        self._ensure_helpers()
+        result = None
+        for record in self.history:
+            if record['index'] < start:
+                continue
+            if stop is not None and record['index'] > stop:
+                break
+            # 命令与检查点在同一次求值中完成
+            target = self._next_checkpoint()
+            result, written = self.session.evaluate(wlexpr(
+                f'{{({record["command"]}), pomaCheckpoint[{wl_string(target)}]}}'
+            ))
+            if written:
+                self._checkpoint = target
+        return result
 
     def disconnect(self):
         """断开连接"""
+        self.history.close()
+        if self._checkpoint_dir:
+            shutil.rmtree(self._checkpoint_dir, ignore_errors=True)
+            self._checkpoint_dir = self._checkpoint = None
         if self.session:
             self.session.terminate()
             print("\n👋 已断开 Wolfram Kernel 连接")
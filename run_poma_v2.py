@@ -9,6 +9,8 @@ import os
 from wolframclient.evaluation import WolframLanguageSession
 from wolframclient.language import wl, wlexpr
 
+from poma_session import load_poma
+
 # WolframKernel 路径
 KERNEL_PATH = "/home/tony/wolfram/Executables/WolframKernel"
 
@@ -34,14 +36,11 @@ def main():
         session = WolframLanguageSession(kernel=KERNEL_PATH)
         print("✓ 连接成功!\n")
 
-        # 设置工作目录
+        # 设置工作目录并加载 POMA 包 (优先使用预编译镜像)
         print(f"设置工作目录: {current_dir}")
-        session.evaluate(wlexpr(f'SetDirectory["{current_dir}"]'))
-
-        # 加载 POMA 包
         print("\n正在加载 Poma2.m...")
-        result = session.evaluate(wlexpr('<<Poma2`'))
-        print("✓ POMA 包加载成功!\n")
+        source = load_poma(session, current_dir)
+        print(f"✓ POMA 包加载成功! ({'预编译镜像' if source == 'image' else '源码，已生成镜像'})\n")
 
         # 显示可用命令
         print("-" * 50)